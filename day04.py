@@ -142,20 +142,163 @@ passports are valid?
 """
 
 import argparse
+import json
+import os
+import re
+import timeit
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from itertools import islice
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple)
+from utils import split_records
 
 parser = argparse.ArgumentParser(epilog=__doc__,
                                  formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('input', type=argparse.FileType('rt'))
+parser.add_argument('input', type=argparse.FileType('rt'), nargs='?')
 parser.add_argument('--part-two', action='store_true')
+parser.add_argument('--benchmark',
+                    action='store_true',
+                    help='Compare validators against exception based ones')
+parser.add_argument('--rules',
+                    type=argparse.FileType('rt'),
+                    help='JSON file mapping each required field to its rules\n'
+                    '(length, digits, enum, range, units, regex)')
+parser.add_argument('--stats',
+                    action='store_true',
+                    help='Also output missing and invalid counts per field')
+parser.add_argument('--workers',
+                    type=int,
+                    default=0,
+                    help='Validate chunks of the batch in parallel processes')
+parser.add_argument('--chunk-size',
+                    type=int,
+                    default=10000,
+                    help='How many passports to send to a worker or to store\n'
+                    'in one chunk of columns at once')
+parser.add_argument('--ingest',
+                    metavar='DIRECTORY',
+                    help='Store the batch as columns in the directory')
+parser.add_argument('--columns',
+                    metavar='DIRECTORY',
+                    help='Validate passports stored with --ingest, if input is\n'
+                    'given too it is validated row by row to compare')
 args = parser.parse_args()
 
+if args.input is None and not args.columns:
+    parser.error('input is required unless --columns is given')
+
+Passport = Dict[str, str]
+Validator = Callable[[str], bool]
+RuleSpec = Dict[str, Dict[str, Any]]
+ValidationPlan = List[Tuple[str, Validator]]
+
+
+def is_number(x: str) -> bool:
+    # isdigit() alone would also accept non-ASCII digits like '²'
+    return x.isascii() and x.isdigit()
+
+
+def build_length_check(length: int) -> Validator:
+    return lambda x: len(x) == length
+
+
+def build_digits_check(length: int) -> Validator:
+    return lambda x: len(x) == length and is_number(x)
+
+
+def build_enum_check(values: List[str]) -> Validator:
+    return frozenset(values).__contains__
+
+
+def build_range_check(bounds: List[int]) -> Validator:
+    lower, upper = bounds
+    return lambda x: is_number(x) and lower <= int(x) <= upper
+
+
+def build_units_check(units: Dict[str, List[int]]) -> Validator:
+    unit_ranges = {unit: range(lower, upper + 1)
+                   for unit, (lower, upper) in units.items()}
+
+    def check(x: str) -> bool:
+        value = re.match('[0-9]*', x).group()
+        valid_range = unit_ranges.get(x[len(value):])
+        return (valid_range is not None and value != ''
+                and int(value) in valid_range)
+
+    return check
+
+
+def build_regex_check(pattern: str) -> Validator:
+    regex = re.compile(pattern)
+    return lambda x: regex.fullmatch(x) is not None
+
+
+# rule kinds with their relative cost, cheap checks are evaluated first
+rule_kinds: Dict[str, Tuple[int, Callable[[Any], Validator]]] = {
+    'length': (0, build_length_check),
+    'digits': (1, build_digits_check),
+    'enum': (1, build_enum_check),
+    'range': (2, build_range_check),
+    'units': (3, build_units_check),
+    'regex': (4, build_regex_check),
+}
+
+# as per puzzle definition, same format as the JSON file given with --rules
+default_rules: RuleSpec = {
+    'byr': {'digits': 4, 'range': [1920, 2002]},
+    'iyr': {'digits': 4, 'range': [2010, 2020]},
+    'eyr': {'digits': 4, 'range': [2020, 2030]},
+    'hgt': {'units': {'cm': [150, 193], 'in': [59, 76]}},
+    'hcl': {'length': 7, 'regex': '#[0-9a-f]{6}'},
+    'ecl': {'enum': ['amb', 'blu', 'brn', 'gry', 'grn', 'hzl', 'oth']},
+    'pid': {'digits': 9},
+}
+
+
+def compile_rules(rules: RuleSpec) -> ValidationPlan:
+    plan = []
+    for field, field_rules in rules.items():
+        for kind, spec in field_rules.items():
+            if kind not in rule_kinds:
+                raise Exception(f'Unhandled rule "{kind}" for field "{field}"')
+
+            cost, build_check = rule_kinds[kind]
+            plan.append((cost, field, build_check(spec)))
+
+    # sort is stable, so checks of equal cost keep the order of the rules
+    plan.sort(key=lambda entry: entry[0])
+
+    return [(field, check) for _, field, check in plan]
+
+
+rules = json.load(args.rules) if args.rules else default_rules
+
+required_fields = frozenset(rules)
+
+# checks never throw, so no exception handling is needed on the hot path
+validation_plan = compile_rules(rules)
+
+
+
+def group_checks(plan: ValidationPlan) -> Dict[str, List[Validator]]:
+    # same checks and order, but grouped to tell which field failed
+    field_checks: Dict[str, List[Validator]] = {}
+    for field, check in plan:
+        field_checks.setdefault(field, []).append(check)
+    return field_checks
+
+
+field_checks = group_checks(validation_plan)
+
 height_range = {
     'cm': range(150, 193 + 1),
     'in': range(59, 76 + 1),
 }
 
-required_fields = {
+# original rules, kept to compare against when benchmarking
+raising_fields: Dict[str, Validator] = {
     'byr': lambda x: int(x) in range(1920, 2002 + 1),
     'iyr': lambda x: int(x) in range(2010, 2020 + 1),
     'eyr': lambda x: int(x) in range(2020, 2030 + 1),
@@ -165,30 +308,357 @@ required_fields = {
     'pid': lambda x: (int(x) + 1) and len(x) == 9,
 }
 
-valid_passports = 0
-passport = dict()
 
-# use split() instead of readlines() to properly treat last line
-for line in args.input.read().split('\n'):
-    if line:
-        properties = line.split(' ')
-        passport.update(dict([prop.split(':')
-                              for prop in properties]))
-        continue
+def has_required_fields(passport: Passport) -> bool:
+    return not (required_fields - passport.keys())
+
+
+def has_valid_fields(passport: Passport) -> bool:
+    for field, check in validation_plan:
+        if not check(passport[field]):
+            return False
+    return True
+
+
+def has_valid_fields_raising(passport: Passport) -> bool:
+    try:
+        return all(validator(passport[field])
+                   for field, validator in raising_fields.items())
+    except:
+        # validation rules throw exceptions on purpose to mark it invalid
+        return False
+
+
+def benchmark(passports: List[Passport]):
+    complete = list(filter(has_required_fields, passports))
+    invalid = [p for p in complete if not has_valid_fields(p)]
+
+    for name, batch in (('complete', complete), ('invalid only', invalid)):
+        for validate in (has_valid_fields, has_valid_fields_raising):
+            seconds = min(timeit.repeat(lambda: list(map(validate, batch)),
+                                        number=100, repeat=5))
+            print(f'{name:>12} ({len(batch):4} passports) '
+                  f'{validate.__name__:>24}: {seconds * 10:.3f} ms/batch')
+
+
+def parse_passport(record: List[str]) -> Passport:
+    return dict(prop.split(':') for line in record for prop in line.split(' '))
+
+
+class ValidationStats:
+    def __init__(self):
+        self.valid = 0
+        self.missing: Counter = Counter()
+        self.invalid: Counter = Counter()
+
+    def add(self, passport: Passport):
+        missing = required_fields - passport.keys()
+        self.missing.update(missing)
+
+        invalid = []
+        if args.part_two:
+            # check every field instead of stopping at the first failure
+            invalid = [field for field, checks in field_checks.items()
+                       if field in passport
+                       and not all(check(passport[field]) for check in checks)]
+            self.invalid.update(invalid)
+
+        self.valid += not (missing or invalid)
+
+    def __iadd__(self, other: 'ValidationStats') -> 'ValidationStats':
+        self.valid += other.valid
+        self.missing += other.missing
+        self.invalid += other.invalid
+        return self
+
+    def print_fields(self):
+        for field in rules:
+            print(f'{field}: {self.missing[field]} missing, '
+                  f'{self.invalid[field]} invalid')
+
+
+def collect_stats(records: Iterable[List[str]]) -> ValidationStats:
+    stats = ValidationStats()
+    for record in records:
+        stats.add(parse_passport(record))
+    return stats
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def init_worker(rules_spec: RuleSpec, part_two: bool):
+    # compiled checks are closures that cannot be pickled, so every worker
+    # compiles its own from the rules instead of relying on fork
+    global required_fields, field_checks
+    args.part_two = part_two
+    required_fields = frozenset(rules_spec)
+    field_checks = group_checks(compile_rules(rules_spec))
+
+
+def collect_stats_parallel(records: Iterable[List[str]],
+                           workers: int,
+                           chunk_size: int) -> ValidationStats:
+    stats = ValidationStats()
+
+    with ProcessPoolExecutor(workers,
+                             initializer=init_worker,
+                             initargs=(rules, args.part_two)) as pool:
+        # limit chunks in flight so the batch is not read into memory at once
+        pending = deque()
+        for chunk in chunked(records, chunk_size):
+            if len(pending) >= 2 * workers:
+                stats += pending.popleft().result()
+            pending.append(pool.submit(collect_stats, chunk))
+
+        while pending:
+            stats += pending.popleft().result()
+
+    return stats
 
-    is_valid = not (required_fields.keys() - passport.keys())
+
+# Columnar store written by --ingest: for every field a fixed width bytes
+# column with the raw values, their length in characters, the value of the
+# leading digits (-1 if there are none) and the rest after them, so ranges
+# and units need no parsing. Values of leading digits beyond int64 are only
+# flagged as overflow and checked row by row. A presence bitmask has bit i
+# set if field i exists in a passport. Every --chunk-size passports are stored
+# in their own numbered subdirectory, so neither ingesting nor validating has
+# more than one chunk in memory.
+
+INT64_MAX = (1 << 63) - 1
+
+
+def ingest_columns(records: Iterable[List[str]],
+                   directory: str,
+                   chunk_size: int):
+    os.makedirs(directory, exist_ok=True)
+    assert not os.listdir(directory), f'{directory} is not empty'
+
+    for index, chunk in enumerate(chunked(records, chunk_size)):
+        ingest_chunk(chunk, os.path.join(directory, f'{index:06}'))
+
+
+def ingest_chunk(records: List[List[str]], directory: str):
+    import numpy as np
+
+    columns: Dict[str, List[Optional[str]]] = {}
+    count = 0
+    for count, record in enumerate(records, 1):
+        for field, value in parse_passport(record).items():
+            # pad with None where the field was missing in earlier passports
+            column = columns.setdefault(field, [])
+            column.extend([None] * (count - 1 - len(column)))
+            column.append(value)
+
+    fields = sorted(columns)
+    assert len(fields) <= 64, 'Presence bitmask is limited to 64 fields'
+    presence = np.zeros(count,
+                        dtype=np.min_scalar_type((1 << len(fields)) - 1))
+
+    os.makedirs(directory)
+    for bit, field in enumerate(fields):
+        column = columns[field]
+        column.extend([None] * (count - len(column)))
+
+        present = np.array([value is not None for value in column])
+        presence[present] |= presence.dtype.type(1 << bit)
+
+        values = [value or '' for value in column]
+        raw = np.array([value.encode() for value in values], dtype=bytes)
+
+        length = np.array([len(value) for value in values], dtype=np.int64)
+
+        prefix = [re.match('[0-9]*', value).group() for value in values]
+        prefix_number = [int(p) if p else -1 for p in prefix]
+        overflow = np.array([n > INT64_MAX for n in prefix_number])
+        number = np.array([-1 if n > INT64_MAX else n for n in prefix_number],
+                          dtype=np.int64)
+        rest = np.array([value[len(p):].encode()
+                         for p, value in zip(prefix, values)], dtype=bytes)
+
+        np.save(os.path.join(directory, f'{field}.raw.npy'), raw)
+        np.save(os.path.join(directory, f'{field}.length.npy'), length)
+        np.save(os.path.join(directory, f'{field}.number.npy'), number)
+        np.save(os.path.join(directory, f'{field}.overflow.npy'), overflow)
+        np.save(os.path.join(directory, f'{field}.rest.npy'), rest)
+
+    np.save(os.path.join(directory, 'presence.npy'), presence)
+    with open(os.path.join(directory, 'fields.json'), 'wt') as f:
+        json.dump(fields, f)
+
+
+class FieldColumns:
+    def __init__(self, directory: str, field: str):
+        import numpy as np
+
+        def load(name):
+            path = os.path.join(directory, f'{field}.{name}.npy')
+            return np.load(path, mmap_mode='r')
+
+        self.raw = load('raw')
+        self.length = load('length')
+        self.number = load('number')
+        self.overflow = load('overflow')
+        self.rest = load('rest')
+
+
+def with_overflow_fallback(column_check, check: Validator):
+    import numpy as np
+
+    def checked(c: FieldColumns):
+        valid = column_check(c) & ~c.overflow
+        # digits beyond int64 are rare, check them like rows are checked
+        for i in np.flatnonzero(c.overflow):
+            valid[i] = check(c.raw[i].decode())
+        return valid
+
+    return checked
+
+
+def build_length_column_check(length: int):
+    return lambda c: c.length == length
+
+
+def build_digits_column_check(length: int):
+    import numpy as np
+    return lambda c: (c.length == length) & np.char.isdigit(c.raw)
+
+
+def build_enum_column_check(values: List[str]):
+    import numpy as np
+    encoded = [value.encode() for value in values]
+    return lambda c: np.isin(c.raw, encoded)
+
+
+def build_range_column_check(bounds: List[int]):
+    lower, upper = bounds
+    return with_overflow_fallback(
+        lambda c: ((c.rest == b'') & (c.number >= 0)
+                   & (lower <= c.number) & (c.number <= upper)),
+        build_range_check(bounds))
+
+
+def build_units_column_check(units: Dict[str, List[int]]):
+    def check(c: FieldColumns):
+        valid = False
+        for unit, (lower, upper) in units.items():
+            valid = valid | ((c.rest == unit.encode()) & (c.number >= 0)
+                             & (lower <= c.number) & (c.number <= upper))
+        return valid
+
+    return with_overflow_fallback(check, build_units_check(units))
+
+
+def build_regex_column_check(pattern: str):
+    import numpy as np
+    regex = re.compile(pattern)
+
+    def check(c: FieldColumns):
+        # match every distinct value only once
+        distinct, inverse = np.unique(c.raw, return_inverse=True)
+        matches = np.array([regex.fullmatch(value.decode()) is not None
+                            for value in distinct], dtype=bool)
+        return matches[inverse]
+
+    return check
+
+
+column_rule_kinds = {
+    'length': build_length_column_check,
+    'digits': build_digits_column_check,
+    'enum': build_enum_column_check,
+    'range': build_range_column_check,
+    'units': build_units_column_check,
+    'regex': build_regex_column_check,
+}
+
+
+def count_valid_columns(directory: str, rules: RuleSpec) -> int:
+    return sum(count_valid_chunk(os.path.join(directory, chunk), rules)
+               for chunk in sorted(os.listdir(directory)))
+
+
+def count_valid_chunk(directory: str, rules: RuleSpec) -> int:
+    import numpy as np
+
+    with open(os.path.join(directory, 'fields.json'), 'rt') as f:
+        fields = json.load(f)
+    presence = np.load(os.path.join(directory, 'presence.npy'), mmap_mode='r')
+
+    if not required_fields <= set(fields):
+        # a required field that never occurs invalidates every passport
+        # of the chunk
+        return 0
+
+    required_mask = sum(1 << fields.index(field) for field in rules)
+    valid = (presence & required_mask) == required_mask
 
     if args.part_two:
-        try:
-            is_valid &= all(required_fields[prop](passport[prop])
-                            for prop in required_fields)
-        except:
-            # validation rules throw exceptions on purpose to mark it invalid
-            is_valid = False
+        for field, field_rules in rules.items():
+            columns = FieldColumns(directory, field)
+            for kind, spec in field_rules.items():
+                valid &= column_rule_kinds[kind](spec)(columns)
+
+    return int(np.count_nonzero(valid))
+
+
+# workers started without fork import this script again, so only run it
+# when executed directly
+if __name__ == '__main__':
+    if args.ingest:
+        ingest_columns(split_records(args.input), args.ingest, args.chunk_size)
+        exit()
+
+    if args.columns:
+        valid_passports = count_valid_columns(args.columns, rules)
+
+        if args.input:
+            valid_rows = sum(
+                has_required_fields(passport)
+                and (not args.part_two or has_valid_fields(passport))
+                for passport in map(parse_passport, split_records(args.input)))
+            assert valid_passports == valid_rows, (
+                f'Columns found {valid_passports} valid, rows {valid_rows}')
+
+        print(valid_passports)
+        exit()
+
+    if args.workers or args.stats:
+        records = split_records(args.input)
+        if args.workers:
+            stats = collect_stats_parallel(records, args.workers,
+                                           args.chunk_size)
+        else:
+            stats = collect_stats(records)
+
+        print(stats.valid)
+        if args.stats:
+            stats.print_fields()
+
+        exit()
+
+    valid_passports = 0
+    passports = []
+
+    # stream records so the batch never has to fit into memory as a whole
+    for record in split_records(args.input):
+        passport = parse_passport(record)
+
+        if args.benchmark:
+            passports.append(passport)
+
+        is_valid = has_required_fields(passport)
 
-    valid_passports += is_valid
+        if args.part_two:
+            is_valid = is_valid and has_valid_fields(passport)
 
-    # reset passport
-    passport = dict()
+        valid_passports += is_valid
 
-print(valid_passports)
+    if args.benchmark:
+        benchmark(passports)
+    else:
+        print(valid_passports)
@@ -74,76 +74,152 @@ What is the ID of your seat?
 """
 
 import argparse
-from itertools import product
-from typing import Iterable
+import re
+import sys
+from typing import Dict, Iterable, List
+from utils import set_bits
 
 parser = argparse.ArgumentParser(epilog=__doc__,
                                  formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument('input', type=argparse.FileType('rt'))
 parser.add_argument('--part-two', action='store_true')
+parser.add_argument('--numpy',
+                    action='store_true',
+                    help='Decode all boarding passes at once with NumPy')
+parser.add_argument('--rows',
+                    type=int,
+                    default=128,
+                    help='Rows of the aircraft, must be a power of two')
+parser.add_argument('--cols',
+                    type=int,
+                    default=8,
+                    help='Seats per row, must be a power of two')
+parser.add_argument('--flights',
+                    action='store_true',
+                    help='Lines are prefixed by a flight ID, output highest\n'
+                    'seat ID and empty seats per flight')
 args = parser.parse_args()
 
+row_bits = args.rows.bit_length() - 1
+col_bits = args.cols.bit_length() - 1
+assert args.rows == 1 << row_bits, 'Rows must be a power of two'
+assert args.cols == 1 << col_bits, 'Columns must be a power of two'
 
-def build_partitioner(lower_symbol: str, upper_symbol: str):
-    assert len(lower_symbol) == 1, 'Only single character allowed'
-    assert len(upper_symbol) == 1, 'Only single character allowed'
+seat_count = args.rows * args.cols
+pass_length = row_bits + col_bits
 
-    def func(location: Iterable[str], position: int = 0) -> int:
-        if not location:
-            # arrived at the end of location string
-            return position
+# the whole pass is just the seat ID in binary: row * cols + column
+seat_id_table = str.maketrans('FBLR', '0101')
+boarding_pass_regex = re.compile(f'[FB]{{{row_bits}}}[LR]{{{col_bits}}}')
 
-        # split first character from rest of location string
-        partition, *rest = location
-        assert partition in (lower_symbol, upper_symbol)
 
-        partition_size = 2**len(location)
-        is_upper_partition = (partition == upper_symbol)
+def decode_seat_id(boarding_pass: str) -> int:
+    # a pass of the wrong length or with other characters would give an ID
+    # outside of the aircraft (or int() would accept '_' and whitespace)
+    assert boarding_pass_regex.fullmatch(boarding_pass), (
+        f'Invalid boarding pass "{boarding_pass}"')
+    return int(boarding_pass.translate(seat_id_table), 2)
 
-        position += is_upper_partition * (partition_size // 2)
 
-        return func(rest, position)
+def decode_seat_ids_numpy(text: str) -> List[int]:
+    import numpy as np
 
-    return func
+    characters = np.frombuffer(text.encode(), dtype=np.uint8)
 
+    line_ends = np.flatnonzero(characters == ord('\n'))
+    if len(characters) and characters[-1] != ord('\n'):
+        line_ends = np.append(line_ends, len(characters))
+    line_starts = np.concatenate(([0], line_ends + 1))[:len(line_ends)]
 
-def build_seat_validator(seats_taken):
-    def validator(seat):
-        # seat is valid if seats before and after it are taken
-        seat_before = (seat[0] - 1, seat[1])
-        seat_after = (seat[0] + 1, seat[1])
+    # blank lines are skipped, every other line has to be exactly one pass,
+    # otherwise all following passes would be shifted
+    non_empty = line_ends > line_starts
+    line_starts, line_ends = line_starts[non_empty], line_ends[non_empty]
+    assert (line_ends - line_starts == pass_length).all(), (
+        f'Every boarding pass must have {pass_length} characters')
 
-        return seat_before in seats_taken and seat_after in seats_taken
+    passes = characters[line_starts[:, None] + np.arange(pass_length)]
 
-    return validator
+    row_table = np.full(256, 2, dtype=np.uint8)
+    row_table[ord('F')], row_table[ord('B')] = 0, 1
+    col_table = np.full(256, 2, dtype=np.uint8)
+    col_table[ord('L')], col_table[ord('R')] = 0, 1
 
+    bits = np.concatenate((row_table[passes[:, :row_bits]],
+                           col_table[passes[:, row_bits:]]), axis=1)
+    assert (bits < 2).all(), 'Only F and B for rows, L and R for columns'
 
-row_partitioner = build_partitioner('F', 'B')
-col_partitioner = build_partitioner('L', 'R')
+    powers_of_two = 1 << np.arange(pass_length - 1, -1, -1, dtype=np.int64)
+    return (bits @ powers_of_two).tolist()
 
-seats_taken = set()
 
-for line in args.input:
-    line = line.strip()
+def new_seat_bitmap() -> bytearray:
+    # one bit per seat, bit (ID % 8) of byte (ID // 8) is set if taken
+    return bytearray((seat_count + 7) // 8)
 
-    row = row_partitioner(line[:7])
-    col = col_partitioner(line[7:])
 
-    seats_taken.add((row, col))
+def build_seat_bitmap(seat_ids: Iterable[int]) -> bytearray:
+    bitmap = new_seat_bitmap()
+    for seat_id in seat_ids:
+        bitmap[seat_id >> 3] |= 1 << (seat_id & 7)
+    return bitmap
 
 
-if args.part_two:
-    # create the set of potential seats in the plane (no first or last row)
-    all_seats = set(product(range(1, 126 + 1), range(0, 7)))
+def find_empty_seats(bitmap: bytearray) -> List[int]:
+    taken = int.from_bytes(bitmap, 'little')
 
-    # only an empty seat could be ours
-    empty_seats = all_seats - seats_taken
+    # empty seats with both neighbours taken, shifting handles all seats at
+    # once and the neighbours of first and last seat are out of the mask
+    all_seats = (1 << seat_count) - 1
+    candidates = ~taken & (taken << 1) & (taken >> 1) & all_seats
 
-    # filter out the only valid seat which is ours (flight is fully booked)
-    my_seat = list(filter(build_seat_validator(seats_taken), empty_seats))
-    assert len(my_seat) == 1
+    return list(set_bits(candidates))
 
-    # overwrite so only this seat is output
-    seats_taken = my_seat
 
-print(max(row * 8 + col for row, col in seats_taken))
+if args.flights:
+    # single pass over all flights, only bitmap and highest ID are kept
+    bitmaps: Dict[str, bytearray] = {}
+    highest_seat_ids: Dict[str, int] = {}
+
+    for line_number, line in enumerate(args.input, 1):
+        fields = line.split()
+        if not fields:
+            continue
+
+        # report malformed lines instead of losing all flights read so far
+        if len(fields) != 2 or not boarding_pass_regex.fullmatch(fields[1]):
+            print(f'Malformed line {line_number}: "{line.strip()}"',
+                  file=sys.stderr)
+            continue
+
+        flight, boarding_pass = fields
+        seat_id = decode_seat_id(boarding_pass)
+
+        if flight not in bitmaps:
+            bitmaps[flight] = new_seat_bitmap()
+            highest_seat_ids[flight] = seat_id
+
+        bitmaps[flight][seat_id >> 3] |= 1 << (seat_id & 7)
+        if seat_id > highest_seat_ids[flight]:
+            highest_seat_ids[flight] = seat_id
+
+    for flight, bitmap in bitmaps.items():
+        print(flight, highest_seat_ids[flight], *find_empty_seats(bitmap))
+
+    exit()
+
+if args.numpy:
+    seat_ids = decode_seat_ids_numpy(args.input.read())
+else:
+    seat_ids = [decode_seat_id(line.strip()) for line in args.input
+                if line.strip()]
+
+if not args.part_two:
+    # no passes, no highest seat ID
+    if seat_ids:
+        print(max(seat_ids))
+else:
+    # seats at the very front and back are missing too, but only ours has
+    # both neighbours taken as the flight is fully booked
+    for seat_id in find_empty_seats(build_seat_bitmap(seat_ids)):
+        print(seat_id)
@@ -99,33 +99,151 @@ What is the sum of those counts?
 
 import argparse
 from functools import reduce
+from operator import and_, or_
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils import set_bits, split_records
 
 parser = argparse.ArgumentParser(epilog=__doc__,
                                  formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument('input', type=argparse.FileType('rt'))
 parser.add_argument('--part-two', action='store_true')
+parser.add_argument('--both',
+                    action='store_true',
+                    help='Output results of part one and two, in that order')
+parser.add_argument('--numpy',
+                    action='store_true',
+                    help='Aggregate the whole file at once with NumPy')
+parser.add_argument('--alphabet',
+                    action='store_true',
+                    help='Any character is a question, not only a to z')
+parser.add_argument('--separator',
+                    help='Questions are identifiers separated by SEPARATOR')
+parser.add_argument('--histogram',
+                    action='store_true',
+                    help='Also output per question how many groups had\n'
+                    'anyone and everyone answer "yes"')
 args = parser.parse_args()
 
+# bit i is set for question chr(ord('a') + i), other characters are ignored
+question_bits = [0] * 256
+for i, question in enumerate(b'abcdefghijklmnopqrstuvwxyz'):
+    question_bits[question] = 1 << i
+
+
+def answer_mask(answer: str) -> int:
+    mask = 0
+    for question in answer.encode():
+        mask |= question_bits[question]
+    return mask
+
+
+def count_yes(groups: Iterable[List[str]]) -> Tuple[int, int]:
+    # both puzzles are solved in the same pass
+    anyone_yes = 0
+    everyone_yes = 0
+
+    for group in groups:
+        masks = [answer_mask(answer) for answer in group]
 
-def reducer(a, b):
-    if args.part_two:
-        # "everyone in group"
-        return a.intersection(b)
-    else:
         # "anyone in group"
-        return a.union(b)
+        anyone_yes += reduce(or_, masks).bit_count()
+        # "everyone in group"
+        everyone_yes += reduce(and_, masks).bit_count()
+
+    return anyone_yes, everyone_yes
+
+
+def count_yes_numpy(text: str) -> Tuple[int, int]:
+    import numpy as np
+
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+
+    # line of every byte is the number of line breaks before it
+    is_newline = data == ord('\n')
+    line_of_byte = np.cumsum(is_newline) - is_newline
+    line_count = int(line_of_byte[-1]) + 1 if len(data) else 0
+
+    is_question = (data >= ord('a')) & (data <= ord('z'))
+    question_lines = line_of_byte[is_question]
+
+    # (lines x 26) matrix of answers, blank lines are rows without any yes
+    answers = np.zeros((line_count, 26), dtype=bool)
+    answers[question_lines, data[is_question] - ord('a')] = True
+
+    is_person = np.zeros(line_count, dtype=bool)
+    is_person[question_lines] = True
+
+    # every blank line starts a new group, consecutive ones don't matter
+    group_of_person = np.cumsum(~is_person)[is_person]
+    group_starts = np.flatnonzero(np.diff(group_of_person, prepend=-1))
+
+    people = answers[is_person]
+    if not len(people):
+        return 0, 0
+
+    anyone = np.logical_or.reduceat(people, group_starts, axis=0)
+    everyone = np.logical_and.reduceat(people, group_starts, axis=0)
+
+    return int(anyone.sum()), int(everyone.sum())
+
+
+class QuestionStats:
+    def __init__(self, any_character: bool):
+        self.any_character = any_character
+        # questions get the next free bit when they are first seen
+        self.question_bits: Dict[str, int] = {}
+        self.anyone_yes: List[int] = []
+        self.everyone_yes: List[int] = []
+
+    def answer_mask(self, answer: str, separator: Optional[str]) -> int:
+        if separator:
+            questions = answer.split(separator)
+        elif self.any_character:
+            questions = answer
+        else:
+            # same questions as answer_mask(), other characters are ignored
+            questions = [q for q in answer if 'a' <= q <= 'z']
+
+        mask = 0
+        for question in questions:
+            bit = self.question_bits.get(question)
+            if bit is None:
+                bit = self.question_bits[question] = len(self.question_bits)
+                self.anyone_yes.append(0)
+                self.everyone_yes.append(0)
+            mask |= 1 << bit
+        return mask
+
+    def add_group(self, group: List[str], separator: Optional[str]):
+        masks = [self.answer_mask(answer, separator) for answer in group]
+
+        for bit in set_bits(reduce(or_, masks)):
+            self.anyone_yes[bit] += 1
+        for bit in set_bits(reduce(and_, masks)):
+            self.everyone_yes[bit] += 1
 
+    def print_histogram(self):
+        for question, bit in self.question_bits.items():
+            print(question, self.anyone_yes[bit], self.everyone_yes[bit])
 
-total_yes = 0
 
-groups = args.input.read().strip().split('\n\n')
+if args.alphabet or args.separator or args.histogram:
+    stats = QuestionStats(any_character=args.alphabet)
+    for group in split_records(args.input):
+        stats.add_group(group, args.separator)
 
-for group in groups:
-    # convert answer string into set
-    answers = [set(answer) for answer in group.split('\n')]
-    # depending on puzzle, combine answers of group members
-    yes_in_group = reduce(reducer, answers)
+    anyone_yes = sum(stats.anyone_yes)
+    everyone_yes = sum(stats.everyone_yes)
+elif args.numpy:
+    anyone_yes, everyone_yes = count_yes_numpy(args.input.read())
+else:
+    anyone_yes, everyone_yes = count_yes(split_records(args.input))
 
-    total_yes += len(yes_in_group)
+if args.both:
+    print(anyone_yes)
+    print(everyone_yes)
+else:
+    print(everyone_yes if args.part_two else anyone_yes)
 
-print(total_yes)
+if args.histogram:
+    stats.print_histogram()
@@ -83,28 +83,44 @@ How many individual bags are required inside your single shiny gold bag?
 """
 
 import argparse
+import os
 import re
-from collections import defaultdict
-from typing import Dict, Iterable, List, Set, Callable, Optional
-from functools import reduce
-from itertools import product
-from utils import pairwise
+import sys
+from array import array
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 WeightedDAG = Dict[str, Dict[str, int]]
 
 parser = argparse.ArgumentParser(epilog=__doc__,
                                  formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('input', type=argparse.FileType('rt'))
+parser.add_argument('input', type=argparse.FileType('rt'), nargs='?')
 parser.add_argument('--part-two', action='store_true')
+parser.add_argument('--bag',
+                    default='shiny gold',
+                    help='Color of the bag to answer for')
+parser.add_argument('--save-index',
+                    metavar='DIRECTORY',
+                    help='Save the parsed rules as an index in the directory')
+parser.add_argument('--index',
+                    metavar='DIRECTORY',
+                    help='Load rules from an index instead of the input')
+parser.add_argument('--queries',
+                    type=argparse.FileType('rt'),
+                    help='File with one bag color per line, outputs number\n'
+                    'of bags that can contain it and that it contains')
+parser.add_argument('--updates',
+                    type=argparse.FileType('rt'),
+                    help='File with rules to insert or replace and lines\n'
+                    '"- <color>" to delete the rule of a bag, outputs the\n'
+                    'answer after every update')
 args = parser.parse_args()
 
-rules = [line.strip() for line in args.input]
+if (args.input is None) == (args.index is None):
+    parser.error('either input or --index is required')
 
 
-dag: WeightedDAG = defaultdict(lambda: {})
-
-
-for rule in rules:
+def parse_rule(rule: str) -> Tuple[str, Dict[str, int]]:
     bag, contain_rules = rule.split(' bags contain ')
 
     sub_bags = re.split(' bag[s]?[,. ]+', contain_rules)
@@ -112,31 +128,45 @@ for rule in rules:
     # remove last element as it should be always empty
     assert sub_bags.pop() == ''
 
+    counts = {}
     for sub_bag in sub_bags:
         if sub_bag == 'no other':
             continue
 
         _, count, color, = re.split('([0-9]+) ', sub_bag)
 
-        dag[color][bag] = int(count)
+        counts[color] = int(count)
+
+    return bag, counts
+
 
+def parse_rules(rules: Iterable[str]) -> WeightedDAG:
+    # edges point from a bag to the bags it can be contained in
+    dag: WeightedDAG = defaultdict(lambda: {})
 
-def flatten(iterable: Iterable) -> List:
-    return [e for sub_iterable in iterable for e in sub_iterable]
+    for rule in rules:
+        bag, sub_bags = parse_rule(rule)
 
+        for color, count in sub_bags.items():
+            dag[color][bag] = count
 
-def traverse(dag: WeightedDAG, vertex: str):
-    super_vertices = list(dag[vertex])
-    return super_vertices + flatten(traverse(dag, vertex)
-                                    for vertex in super_vertices)
+    return dag
 
 
-start_bag = 'shiny gold'
+def find_super_vertices(dag: WeightedDAG, start: str) -> Set[str]:
+    # breadth-first search, each vertex is expanded only once no matter on
+    # how many paths it can be reached
+    visited = set()
+    queue = deque([start])
 
-super_bags = set(traverse(dag, start_bag))
-sub_bags = dag.keys() - super_bags - set([start_bag])
+    while queue:
+        for super_vertex in dag[queue.popleft()]:
+            if super_vertex not in visited:
+                visited.add(super_vertex)
+                queue.append(super_vertex)
+
+    return visited
 
-sub_bags_dag = {k: v for k, v in dag.items() if k in sub_bags}
 
 def invert_dag(dag: WeightedDAG):
     dag_inverted = defaultdict(lambda: {})
@@ -147,95 +177,273 @@ def invert_dag(dag: WeightedDAG):
 
     return dag_inverted
 
-if not args.part_two:
-    print(len(super_bags))
-else:
-    # invert DAG and filter out super bags before
-    dag_inverted = invert_dag(sub_bags_dag)
-
-    leafs = [vertex for vertex in sub_bags if not dag_inverted[vertex]]
-    # print(leafs)
-
-    def go_up(dag: WeightedDAG, start: str, end: str):
-        next_vertices = dag[start]
-        is_end = (start == end)
-
-        if (not next_vertices) or is_end:
-            return [(is_end, [start])]
-
-        out = []
-        for next_vertex, weight in next_vertices.items():
-            out.extend([(is_end or keep, [start] + l) for keep, l in list(go_up(dag, next_vertex, end))])
-
-        return out
-
-    intermediate_bags_already_counted = set()
-
-    dag_contained_bags = defaultdict(lambda: {})
 
-    total_bag_count = 0
+def count_contained(dag_inverted: WeightedDAG, start: str,
+                    counts: Optional[Dict[str, int]] = None) -> int:
+    # count(bag) = sum of weight * (1 + count(sub bag)), evaluated bottom up
+    # with an explicit stack so every bag is counted once and deeply nested
+    # rules don't hit the recursion limit
+    if counts is None:
+        counts = {}
+    stack = [start]
 
-    individual_bag_count = defaultdict(lambda: 0)
-
-    for leaf in leafs:
-        valid_paths = list(filter(lambda keep_l: keep_l[0] == True, go_up(dag, leaf, start_bag)))
-
-        for _, path in valid_paths:
-            # print(path)
-
-            for contained, container in pairwise(path):
-                dag_contained_bags[contained][container] = dag[contained][container]
-
-            s = dag_inverted[start_bag]
-
-
-            weights = [dag[a][b] for a,b in pairwise(path)]
-            # print(weights)
-
-            aggregate_count = 1
-            for bag, count in reversed(list(zip(path[1:-1], weights[1:]))):
-                aggregate_count *= count
-
-                if bag not in individual_bag_count:
-                    individual_bag_count[bag] += aggregate_count
+    while stack:
+        bag = stack[-1]
+        if bag in counts:
+            stack.pop()
+            continue
 
-            bag_count = reduce(lambda a, b: a * b, weights)
-            # print(bag_count)
+        sub_bags = dag_inverted[bag]
+        uncounted = [sub_bag for sub_bag in sub_bags if sub_bag not in counts]
+        if uncounted:
+            stack.extend(uncounted)
+            continue
 
-            weighted_pairs = list(zip(pairwise(path), weights))
-            # print(weighted_pairs)
+        stack.pop()
+        counts[bag] = sum(weight * (1 + counts[sub_bag])
+                          for sub_bag, weight in sub_bags.items())
+
+    return counts[start]
+
+
+class CycleError(Exception):
+    pass
+
+
+class BagRules:
+    """
+    Rules that can be changed one bag at a time. Counts of contained bags are
+    memoized and only those of the changed bag and the bags that can contain
+    it are invalidated.
+    """
+
+    def __init__(self, dag: WeightedDAG):
+        self.dag = dag
+        self.dag_inverted = invert_dag(dag)
+        self.counts: Dict[str, int] = {}
+
+    def set_rule(self, rule: str):
+        "Insert a rule or replace the existing rule of the same bag"
+        bag, sub_bags = parse_rule(rule)
+
+        # a cycle exists if the bag is inside one of its new sub bags
+        stack = list(sub_bags)
+        visited = set()
+        while stack:
+            color = stack.pop()
+            if color == bag:
+                raise CycleError(f'Rule for "{bag}" introduces a cycle')
+            if color not in visited:
+                visited.add(color)
+                stack.extend(self.dag_inverted.get(color, {}))
+
+        self.remove_rule(bag)
+
+        for color, count in sub_bags.items():
+            self.dag[color][bag] = count
+            self.dag_inverted[bag][color] = count
+
+    def remove_rule(self, bag: str):
+        for color in self.dag_inverted.pop(bag, {}):
+            del self.dag[color][bag]
+
+        # counts are memoized bottom up, so if a bag has no count none of the
+        # bags containing it has one either
+        queue = deque([bag])
+        while queue:
+            color = queue.popleft()
+            if self.counts.pop(color, None) is not None:
+                queue.extend(self.dag.get(color, {}))
+
+    def count_contained(self, bag: str) -> int:
+        return count_contained(self.dag_inverted, bag, self.counts)
+
+    def count_super_bags(self, bag: str) -> int:
+        return len(find_super_vertices(self.dag, bag))
+
+
+class BagIndex:
+    """
+    Bag colors mapped to integer IDs with edges from every bag to the bags it
+    contains in compressed sparse row layout: the sub bags of bag i are
+    targets[offsets[i]:offsets[i + 1]] with the same slice of weights.
+    """
+
+    def __init__(self, colors: List[str], offsets: array, targets: array,
+                 weights: array):
+        self.colors = colors
+        self.ids = {color: i for i, color in enumerate(colors)}
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+
+    @classmethod
+    def from_dag(cls, dag: WeightedDAG) -> 'BagIndex':
+        dag_inverted = invert_dag(dag)
+        colors = sorted(dag.keys() | dag_inverted.keys())
+
+        ids = {color: i for i, color in enumerate(colors)}
+        offsets, targets, weights = array('q', [0]), array('i'), array('q')
+        for color in colors:
+            for sub_bag, weight in dag_inverted.get(color, {}).items():
+                targets.append(ids[sub_bag])
+                weights.append(weight)
+            offsets.append(len(targets))
+
+        return cls(colors, offsets, targets, weights)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'colors.txt'), 'wt') as f:
+            f.writelines(f'{color}\n' for color in self.colors)
+
+        for name in ('offsets', 'targets', 'weights'):
+            with open(os.path.join(directory, f'{name}.bin'), 'wb') as f:
+                getattr(self, name).tofile(f)
+
+    @classmethod
+    def load(cls, directory: str) -> 'BagIndex':
+        with open(os.path.join(directory, 'colors.txt'), 'rt') as f:
+            colors = [line.rstrip('\n') for line in f]
+
+        arrays = []
+        for name, typecode in (('offsets', 'q'), ('targets', 'i'),
+                               ('weights', 'q')):
+            path = os.path.join(directory, f'{name}.bin')
+            values = array(typecode)
+            with open(path, 'rb') as f:
+                values.fromfile(f, os.path.getsize(path) // values.itemsize)
+            arrays.append(values)
+
+        return cls(colors, *arrays)
+
+    def sub_bags(self, bag: int) -> Iterable[Tuple[int, int]]:
+        start, stop = self.offsets[bag], self.offsets[bag + 1]
+        return zip(self.targets[start:stop], self.weights[start:stop])
+
+    def topological_order(self) -> List[int]:
+        # Kahn's algorithm, outermost bags first
+        in_degree = [0] * len(self.colors)
+        for target in self.targets:
+            in_degree[target] += 1
+
+        order = [bag for bag, degree in enumerate(in_degree) if degree == 0]
+        for bag in order:
+            for sub_bag, _ in self.sub_bags(bag):
+                in_degree[sub_bag] -= 1
+                if not in_degree[sub_bag]:
+                    order.append(sub_bag)
+
+        assert len(order) == len(self.colors), 'Rules contain a cycle'
+        return order
+
+    def answer(self, bags: Iterable[int]) -> Tuple[List[int], List[int]]:
+        """
+        Number of bags that can contain each of the bags and that each of them
+        contains. All bags are answered in one sweep from the innermost bags
+        outwards.
+        """
+        order = self.topological_order()
+        # only the asked bags get a bit, so asking for a few bags costs no
+        # more than a search from each of them
+        wanted_bits = {bag: bit for bit, bag in enumerate(dict.fromkeys(bags))}
+
+        # bits of the asked bags that a bag can contain
+        sub_masks = [0] * len(self.colors)
+        # bit-sliced counters: bit i of the number of bags that can contain
+        # the asked bag with bit w is bit w of counters[i], so counting all
+        # set bits of a mask takes a few big integer operations
+        counters: List[int] = []
+        contained_counts = [0] * len(self.colors)
+        for bag in reversed(order):
+            mask = 0
+            contained = 0
+            for sub_bag, weight in self.sub_bags(bag):
+                mask |= sub_masks[sub_bag]
+                contained += weight * (1 + contained_counts[sub_bag])
+            contained_counts[bag] = contained
+
+            carry, i = mask, 0
+            while carry:
+                if i == len(counters):
+                    counters.append(0)
+                counters[i], carry = counters[i] ^ carry, counters[i] & carry
+                i += 1
+
+            if bag in wanted_bits:
+                mask |= 1 << wanted_bits[bag]
+            sub_masks[bag] = mask
+
+        super_bag_counts = [0] * len(self.colors)
+        for bag, bit in wanted_bits.items():
+            super_bag_counts[bag] = sum(((counter >> bit) & 1) << i
+                                        for i, counter in enumerate(counters))
+
+        return super_bag_counts, contained_counts
+
+
+if args.index:
+    index = BagIndex.load(args.index)
+else:
+    dag = parse_rules(line.strip() for line in args.input)
+    index = None
 
+if args.updates:
+    assert index is None, 'Updates need the rules as input'
+    bag_rules = BagRules(dag)
 
-            intermediate_pairs = list(weighted_pairs)[1:]
-            # print(intermediate_pairs)
+    for line in args.updates:
+        line = line.strip()
+        if not line:
+            continue
 
-            intermediate_sum = sum([weight for pair, weight in filter(lambda pair: pair[0][0] not in intermediate_bags_already_counted, intermediate_pairs)])
-            # print('intermediate_sum: ', intermediate_sum)
+        if line.startswith('- '):
+            bag_rules.remove_rule(line[2:])
+        else:
+            try:
+                bag_rules.set_rule(line)
+            except CycleError as e:
+                # rules are unchanged, so the answer below is still current
+                print(f'Rejected "{line}": {e}', file=sys.stderr)
 
-            # bag_count += intermediate_sum
+        if not args.part_two:
+            print(bag_rules.count_super_bags(args.bag))
+        else:
+            print(bag_rules.count_contained(args.bag))
 
-            intermediate_bags_already_counted |= set([pair[0] for pair, weight in intermediate_pairs])
-            # print(intermediate_bags_already_counted)
+    exit()
 
-            total_bag_count += bag_count
+if args.save_index:
+    (index or BagIndex.from_dag(dag)).save(args.save_index)
+    exit()
 
-    # print('total_bag_count: ', total_bag_count)
+if args.queries or index:
+    if index is None:
+        index = BagIndex.from_dag(dag)
 
-    # pprint(dag_contained_bags)
+    if args.queries:
+        colors = [line.strip() for line in args.queries if line.strip()]
+    else:
+        colors = [args.bag]
 
+    for color in colors:
+        if color not in index.ids:
+            raise Exception(f'Unknown bag color "{color}"')
 
-    def get_individual_count(dag: WeightedDAG, start: str):
-        super_vertices = dag[start]
-        if not super_vertices:
-            return 1
+    bags = [index.ids[color] for color in colors]
+    super_bag_counts, contained_counts = index.answer(bags)
 
-        counts = []
-        for vertex, weight in super_vertices.items():
-            counts.append(weight * get_individual_count(dag, vertex))
-        return sum(counts)
+    if args.queries:
+        for color, bag in zip(colors, bags):
+            print(f'{color}: {super_bag_counts[bag]} {contained_counts[bag]}')
+    elif not args.part_two:
+        print(super_bag_counts[bags[0]])
+    else:
+        print(contained_counts[bags[0]])
 
-    candidates = dag_contained_bags.keys() - set(leafs) - set([start_bag])
-    individual_count = sum([get_individual_count(dag_contained_bags, bag) for bag in candidates])
-    # print('individual count: ', individual_count)
+    exit()
 
-    print(total_bag_count + individual_count)
+if not args.part_two:
+    print(len(find_super_vertices(dag, args.bag)))
+else:
+    print(count_contained(invert_dag(dag), args.bag))
@@ -122,61 +122,393 @@ terminates?
 """
 
 import argparse
-from typing import List, Tuple
+import csv
+import os
+import runpy
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 parser = argparse.ArgumentParser(epilog=__doc__,
                                  formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('input', type=argparse.FileType('rt'))
+parser.add_argument('input', type=argparse.FileType('rt'), nargs='?')
 parser.add_argument('--part-two', action='store_true')
+parser.add_argument('--profile',
+                    type=argparse.FileType('wt'),
+                    help='Write executions per instruction as CSV')
+parser.add_argument('--trace',
+                    type=argparse.FileType('wb'),
+                    help='Write instruction pointer and accumulator after\n'
+                    'every step as pairs of native 64 bit integers')
+parser.add_argument('--batch',
+                    metavar='PATH',
+                    help='Directory of programs or file listing one program\n'
+                    'per line, outputs status, accumulator, repaired line and\n'
+                    'accumulator of the repaired program for each')
+parser.add_argument('--workers',
+                    type=int,
+                    help='Processes to use for --batch, defaults to CPU count')
+parser.add_argument('--optimize',
+                    action='store_true',
+                    help='Fuse runs of acc and nop before emulating')
+parser.add_argument('--instructions',
+                    metavar='FILE',
+                    help='Python file adding instructions by calling\n'
+                    'register_instruction(name, handler, branch=False),\n'
+                    'see day08_instructions.py')
 args = parser.parse_args()
 
+if (args.input is None) == (args.batch is None):
+    parser.error('either input or --batch is required')
 
-def emulate(program: List[str]) -> Tuple[bool, int]:
-    commands_executed = set()
+# lines of the optimized program don't match the lines of the input
+if args.optimize and (args.profile or args.trace):
+    parser.error('--profile and --trace cannot be used with --optimize')
+
+ACC, JMP, NOP = range(3)
+
+opcodes = {
+    'acc': ACC,
+    'jmp': JMP,
+    'nop': NOP,
+}
+
+# handlers of further instructions get argument, instruction pointer and
+# accumulator and return the new instruction pointer and accumulator
+Handler = Callable[[int, int, int], Tuple[int, int]]
+handlers: Dict[int, Handler] = {}
+
+# instructions that may jump by their argument instead of continuing with the
+# next line, all other instructions must always continue with the next line
+branching: Set[int] = {JMP}
+
+
+def register_instruction(name: str, handler: Handler,
+                         branch: bool = False) -> int:
+    if name in opcodes:
+        raise Exception(f'Instruction "{name}" already exists')
+
+    opcode = len(opcodes)
+    opcodes[name] = opcode
+    handlers[opcode] = handler
+    if branch:
+        branching.add(opcode)
+
+    return opcode
+
+
+if args.instructions:
+    runpy.run_path(args.instructions,
+                   init_globals={'register_instruction': register_instruction})
+
+# program compiled into parallel arrays of opcodes and arguments
+Program = Tuple[array, array]
+
+
+def compile_program(source: List[str]) -> Program:
+    instructions = array('b')
+    arguments = array('i')
+
+    for command in source:
+        instruction, arg = command.split(' ')
+        if instruction not in opcodes:
+            raise Exception(f'Unhandled instruction "{instruction}"')
+
+        instructions.append(opcodes[instruction])
+        arguments.append(int(arg))
+
+    return instructions, arguments
+
+
+def emulate(program: Program) -> Tuple[bool, int]:
+    instructions, arguments = program
+
+    program_length = len(instructions)
+    commands_executed = bytearray(program_length)
     instruction_pointer = 0
     accumulator = 0
 
     while True:
-        command = program[instruction_pointer]
+        commands_executed[instruction_pointer] = 1
 
-        instruction, arg = command.split(' ')
-        if instruction == 'acc':
-            accumulator += int(arg)
+        instruction = instructions[instruction_pointer]
+        if instruction == ACC:
+            accumulator += arguments[instruction_pointer]
             instruction_pointer += 1
-        elif instruction == 'jmp':
-            instruction_pointer += int(arg)
-        elif instruction == 'nop':
+        elif instruction == JMP:
+            instruction_pointer += arguments[instruction_pointer]
+        elif instruction == NOP:
             instruction_pointer += 1
         else:
-            raise Exception(f'Unhandled instruction "{instruction}"')
+            instruction_pointer, accumulator = handlers[instruction](
+                arguments[instruction_pointer], instruction_pointer,
+                accumulator)
 
-        if instruction_pointer == len(program):
+        if instruction_pointer == program_length:
             return True, accumulator
-        elif instruction_pointer in commands_executed:
+        elif commands_executed[instruction_pointer]:
             return False, accumulator
 
-        commands_executed.add(instruction_pointer)
 
+class Profile:
+    def __init__(self, program_length: int):
+        self.executions = array('q', bytes(8 * program_length))
+        # instruction pointer and accumulator after every step, interleaved
+        self.trace = array('q')
+        # first instruction that would have been executed a second time
+        self.loop_entry: Optional[int] = None
+
+    def write_csv(self, f, program: Program):
+        instructions, arguments = program
+        mnemonics = {opcode: name for name, opcode in opcodes.items()}
+
+        # instructions executed from the loop entry on form the loop
+        in_loop = set()
+        if self.loop_entry is not None:
+            executed = [0] + self.trace[::2].tolist()
+            in_loop.update(executed[executed.index(self.loop_entry):])
+
+        writer = csv.writer(f)
+        writer.writerow(['line', 'instruction', 'argument', 'executions',
+                         'in_loop'])
+        for line, executions in enumerate(self.executions):
+            writer.writerow([line, mnemonics[instructions[line]],
+                             arguments[line], executions,
+                             int(line in in_loop)])
+
+
+def emulate_profiled(program: Program) -> Tuple[bool, int, Profile]:
+    # same as emulate() but instrumented, kept separate so emulate() doesn't
+    # pay for any of this when no profile is needed
+    instructions, arguments = program
+
+    program_length = len(instructions)
+    commands_executed = bytearray(program_length)
+    instruction_pointer = 0
+    accumulator = 0
 
-program = [line.strip() for line in args.input]
+    profile = Profile(program_length)
+    executions = profile.executions
+    trace = profile.trace
 
-if not args.part_two:
-    _, accumulator = emulate(program)
-    print(accumulator)
-else:
-    for line, command in enumerate(program):
-        instruction, arg = command.split(' ')
+    while True:
+        commands_executed[instruction_pointer] = 1
+        executions[instruction_pointer] += 1
 
-        if instruction == 'acc':
+        instruction = instructions[instruction_pointer]
+        if instruction == ACC:
+            accumulator += arguments[instruction_pointer]
+            instruction_pointer += 1
+        elif instruction == JMP:
+            instruction_pointer += arguments[instruction_pointer]
+        elif instruction == NOP:
+            instruction_pointer += 1
+        else:
+            instruction_pointer, accumulator = handlers[instruction](
+                arguments[instruction_pointer], instruction_pointer,
+                accumulator)
+
+        trace.append(instruction_pointer)
+        trace.append(accumulator)
+
+        if instruction_pointer == program_length:
+            return True, accumulator, profile
+        elif commands_executed[instruction_pointer]:
+            profile.loop_entry = instruction_pointer
+            return False, accumulator, profile
+
+
+def run(program: Program) -> Tuple[bool, int]:
+    if args.optimize:
+        program = optimize(program)
+
+    if not (args.profile or args.trace):
+        return emulate(program)
+
+    terminated, accumulator, profile = emulate_profiled(program)
+    if args.profile:
+        profile.write_csv(args.profile, program)
+    if args.trace:
+        profile.trace.tofile(args.trace)
+
+    return terminated, accumulator
+
+
+swap_instruction = {JMP: NOP, NOP: JMP}
+
+
+def successor(instruction: int, argument: int, instruction_pointer: int):
+    if instruction == JMP:
+        return instruction_pointer + argument
+    return instruction_pointer + 1
+
+
+def find_repair(program: Program) -> Optional[int]:
+    """
+    Find the jmp or nop that has to be swapped for the program to terminate,
+    in linear time instead of emulating every possible swap
+    """
+    instructions, arguments = program
+    program_length = len(instructions)
+
+    # where a registered branch goes depends on the accumulator, so whether
+    # an instruction reaches the end can't be told without emulating
+    if any(instruction in branching - {JMP} for instruction in instructions):
+        raise Exception('Programs with registered branches cannot be repaired')
+
+    # reverse edges, jumps outside of the program can never terminate
+    predecessors: List[List[int]] = [[] for _ in range(program_length + 1)]
+    for line, (instruction, argument) in enumerate(zip(instructions,
+                                                       arguments)):
+        next_line = successor(instruction, argument, line)
+        if 0 <= next_line <= program_length:
+            predecessors[next_line].append(line)
+
+    # all instructions that reach the end of the program unmodified
+    terminates = bytearray(program_length + 1)
+    terminates[program_length] = 1
+    stack = [program_length]
+    while stack:
+        for line in predecessors[stack.pop()]:
+            if not terminates[line]:
+                terminates[line] = 1
+                stack.append(line)
+
+    # follow the original execution until swapping leads out of the loop
+    executed = bytearray(program_length)
+    line = 0
+    while 0 <= line < program_length and not executed[line]:
+        executed[line] = 1
+
+        instruction, argument = instructions[line], arguments[line]
+        if instruction in swap_instruction:
+            swapped = successor(swap_instruction[instruction], argument, line)
+            if 0 <= swapped <= program_length and terminates[swapped]:
+                return line
+
+        line = successor(instruction, argument, line)
+
+    return None
+
+
+def optimize(program: Program) -> Program:
+    """
+    Fuse runs of acc into a single acc with the sum of their arguments and
+    runs of nop into a single nop. Runs are split at every jump target and
+    jumps are adjusted to the new lines.
+    """
+    instructions, arguments = program
+    program_length = len(instructions)
+
+    is_target = bytearray(program_length + 1)
+    for line, (instruction, argument) in enumerate(zip(instructions,
+                                                       arguments)):
+        target = line + argument
+        if instruction in branching and 0 <= target <= program_length:
+            is_target[target] = 1
+
+    optimized_instructions = array('b')
+    optimized_arguments = array('q')
+    new_lines = array('q')
+
+    for line, (instruction, argument) in enumerate(zip(instructions,
+                                                       arguments)):
+        if (instruction in (ACC, NOP) and not is_target[line]
+                and line > 0 and instructions[line - 1] == instruction):
+            new_lines.append(len(optimized_instructions) - 1)
+            if instruction == ACC:
+                optimized_arguments[-1] += argument
+            continue
+
+        new_lines.append(len(optimized_instructions))
+        optimized_instructions.append(instruction)
+        optimized_arguments.append(argument)
+
+    optimized_length = len(optimized_instructions)
+    new_lines.append(optimized_length)
+
+    for line, instruction in enumerate(instructions):
+        if instruction not in branching:
             continue
 
-        swap_instruction = {'jmp': 'nop', 'nop': 'jmp'}
-        new_command = f'{swap_instruction[instruction]} {arg}'
+        target = line + arguments[line]
+        if 0 <= target <= program_length:
+            new_target = new_lines[target]
+        elif target > program_length:
+            new_target = optimized_length + target - program_length
+        else:
+            new_target = target
+
+        optimized_arguments[new_lines[line]] = new_target - new_lines[line]
+
+    return optimized_instructions, optimized_arguments
+
+
+def patch(program: Program, line: int) -> Program:
+    instructions, arguments = program
+
+    patched_instructions = array('b', instructions)
+    patched_instructions[line] = swap_instruction[instructions[line]]
+
+    return patched_instructions, arguments
 
-        patched_program = program[:]
-        patched_program[line] = new_command
 
-        terminated, accumulator = emulate(patched_program)
+def check_program(path: str) -> str:
+    try:
+        with open(path, 'rt') as f:
+            program = compile_program([line.strip() for line in f])
+
+        terminated, accumulator = emulate(
+            optimize(program) if args.optimize else program)
         if terminated:
-            print(accumulator)
-            break
+            return f'{path} terminated {accumulator} - -'
+
+        line = find_repair(program)
+        if line is None:
+            return f'{path} looped {accumulator} - -'
+
+        _, repaired_accumulator = emulate(patch(program, line))
+        return f'{path} looped {accumulator} {line} {repaired_accumulator}'
+    except Exception as e:
+        # one broken program must not stop the whole batch
+        return f'{path} error {e!r}'
+
+
+def list_programs(path: str) -> List[str]:
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if os.path.isfile(os.path.join(path, name))]
+
+    # paths in a manifest are relative to it
+    with open(path, 'rt') as f:
+        return [os.path.join(os.path.dirname(path), line.strip())
+                for line in f if line.strip()]
+
+
+# workers started without fork import this script again, which parses the
+# arguments and registers instructions for them, so only run it when executed
+# directly
+if __name__ == '__main__':
+    if args.batch:
+        with ProcessPoolExecutor(args.workers) as pool:
+            futures = [pool.submit(check_program, path)
+                       for path in list_programs(args.batch)]
+
+            # report in order of completion, so slow programs don't hold back
+            for future in as_completed(futures):
+                print(future.result(), flush=True)
+
+        exit()
+
+    program = compile_program([line.strip() for line in args.input])
+
+    if not args.part_two:
+        _, accumulator = run(program)
+        print(accumulator)
+    else:
+        line = find_repair(program)
+        assert line is not None, 'Program cannot be repaired'
+
+        terminated, accumulator = run(patch(program, line))
+        assert terminated
+        print(accumulator)
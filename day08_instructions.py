@@ -0,0 +1,18 @@
+"""
+Example of further instructions for day08.py, load with:
+
+    ./day08.py program.txt --instructions day08_instructions.py
+
+register_instruction is provided by day08.py when this file is loaded.
+"""
+
+
+def jump_if_not_zero(argument: int, instruction_pointer: int,
+                     accumulator: int):
+    if accumulator != 0:
+        return instruction_pointer + argument, accumulator
+    return instruction_pointer + 1, accumulator
+
+
+# jnz jumps by its argument only if the accumulator is not zero
+register_instruction('jnz', jump_if_not_zero, branch=True)
@@ -106,49 +106,179 @@ What is the encryption weakness in your XMAS-encrypted list of numbers?
 """
 
 import argparse
-from itertools import permutations
-from typing import Iterable, Optional, Tuple
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 
 parser = argparse.ArgumentParser(epilog=__doc__,
                                  formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument('input', type=argparse.FileType('rt'))
 parser.add_argument('--part-two', action='store_true')
+parser.add_argument('--window',
+                    type=int,
+                    default=25,
+                    help='Number of previous numbers a number is checked\n'
+                    'against (default: 25, as per puzzle definition)')
+parser.add_argument('--stream',
+                    action='store_true',
+                    help='Output every invalid number as soon as it is read,\n'
+                    'keeping only the window in memory')
+parser.add_argument('--numpy',
+                    action='store_true',
+                    help='Check all windows at once with NumPy')
 args = parser.parse_args()
 
-# as per puzzle definition
-WINDOW_SIZE = 25
+# a single number can't form a pair of different numbers
+if args.window < 2:
+    parser.error('--window must be at least 2')
 
-numbers = [int(line.strip()) for line in args.input]
 
-invalid_number = -1
-for i in range(WINDOW_SIZE, len(numbers)):
-    current_number = numbers[i]
+def is_pair_sum(window: Counter, number: int) -> bool:
+    # the two numbers of a pair must have different values
+    return any(number - value in window and number - value != value
+               for value in window)
 
-    # duplicates in window can safely be ignored
-    unique_in_window = set(numbers[i-WINDOW_SIZE:i])
 
-    # build pairs of all permutations
-    pairs = permutations(unique_in_window, 2)
+def detect_invalid(numbers: Iterable[int],
+                   window_size: int) -> Iterator[int]:
+    # only the window is kept: the last numbers in order to know which one
+    # leaves next, and as multiset of values, updated as numbers enter and
+    # leave it instead of rebuilding it for every number
+    recent: Deque[int] = deque()
+    window: Counter = Counter()
 
-    # use any+map so not all permutations have to be materialized and the
-    # calculation stops as soon a matching pair is found
-    if not any(map(lambda pair: pair[0] + pair[1] == current_number, pairs)):
-        invalid_number = current_number
-        break
+    for number in numbers:
+        if len(recent) == window_size:
+            if not is_pair_sum(window, number):
+                yield number
 
-if not args.part_two:
-    print(invalid_number)
-else:
+            leaving_number = recent.popleft()
+            window[leaving_number] -= 1
+            if not window[leaving_number]:
+                del window[leaving_number]
+
+        recent.append(number)
+        window[number] += 1
+
+
+def detect_invalid_numpy(numbers: List[int], window_size: int,
+                         chunk_elements: int = 1 << 18) -> Iterator[int]:
+    """
+    Same as detect_invalid() but checks all pair sums of many windows at once,
+    with chunks of at most chunk_elements pair sums to bound memory
+    """
+    import numpy as np
+
+    # pair sums of numbers beyond 2**62 could overflow int64
+    if any(abs(number) >= 1 << 62 for number in numbers):
+        yield from detect_invalid(numbers, window_size)
+        return
+
+    if len(numbers) <= window_size:
+        return
+
+    values = np.array(numbers, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(values, window_size)
+    chunk_size = max(1, chunk_elements // (window_size * window_size))
+
+    for start in range(window_size, len(values), chunk_size):
+        stop = min(start + chunk_size, len(values))
+        window = windows[start - window_size:stop - window_size]
+        targets = values[start:stop, None, None]
+
+        # the two numbers of a pair must have different values, and a pair of
+        # equal values can only sum up to the target if it's twice the value
+        left, right = window[:, :, None], window[:, None, :]
+        is_pair_sum = ((targets - left == right) & (2 * left != targets)).any(
+            axis=(1, 2))
+
+        yield from values[start:stop][~is_pair_sum].tolist()
+
+
+def find_invalid(numbers: List[int], window_size: int) -> Optional[int]:
+    if args.numpy:
+        return next(detect_invalid_numpy(numbers, window_size), None)
+    return next(detect_invalid(numbers, window_size), None)
+
+
+def find_range_non_negative(numbers: List[int],
+                            target: int) -> Optional[Tuple[int, int]]:
+    """
+    Two pointers over a running sum, only valid if there are no negative
+    numbers. Returns minimum and maximum of the range, which are tracked with
+    monotonic deques of indices while the range moves.
+    """
+    minima: Deque[int] = deque()
+    maxima: Deque[int] = deque()
     start = 0
-    weakness = -1
-    while weakness < 0:
-        for stop in range(start+2, len(numbers)):
-            window = numbers[start:stop]
+    total = 0
+
+    for stop, number in enumerate(numbers):
+        total += number
+        while minima and numbers[minima[-1]] >= number:
+            minima.pop()
+        minima.append(stop)
+        while maxima and numbers[maxima[-1]] <= number:
+            maxima.pop()
+        maxima.append(stop)
 
-            if sum(window) == invalid_number:
-                weakness = min(window) + max(window)
-                break
+        while total > target and start < stop:
+            total -= numbers[start]
+            start += 1
+            if minima[0] < start:
+                minima.popleft()
+            if maxima[0] < start:
+                maxima.popleft()
 
-        start += 1
+        # range has to contain at least two numbers
+        if total == target and stop > start:
+            return numbers[minima[0]], numbers[maxima[0]]
+
+    return None
+
+
+def find_range(numbers: List[int], target: int) -> Optional[Tuple[int, int]]:
+    """
+    Prefix sums with a hash of the first index of every prefix sum, works for
+    negative numbers too. Returns minimum and maximum of the range.
+    """
+    first_index: Dict[int, int] = {}
+    prefix_sums = [0]
+
+    for stop, number in enumerate(numbers, 1):
+        prefix_sums.append(prefix_sums[-1] + number)
+
+        # range has to contain at least two numbers
+        if stop >= 2:
+            first_index.setdefault(prefix_sums[stop - 2], stop - 2)
+
+        start = first_index.get(prefix_sums[stop] - target)
+        if start is not None:
+            contiguous = numbers[start:stop]
+            return min(contiguous), max(contiguous)
+
+    return None
+
+
+if args.stream:
+    numbers_in = (int(line) for line in args.input if line.strip())
+    for invalid_number in detect_invalid(numbers_in, args.window):
+        print(invalid_number, flush=True)
+
+    exit()
+
+numbers = [int(line.strip()) for line in args.input]
+
+invalid_number = find_invalid(numbers, args.window)
+if invalid_number is None:
+    invalid_number = -1
+
+if not args.part_two:
+    print(invalid_number)
+else:
+    if min(numbers) >= 0:
+        extrema = find_range_non_negative(numbers, invalid_number)
+    else:
+        extrema = find_range(numbers, invalid_number)
 
-    print(weakness)
+    assert extrema is not None, 'No contiguous range found'
+    print(sum(extrema))
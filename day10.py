@@ -173,7 +173,9 @@ connect the charging outlet to your device?
 """
 
 import argparse
-from itertools import accumulate
+import sys
+from collections import deque
+from typing import Deque, List, Tuple
 from utils import pairwise
 
 parser = argparse.ArgumentParser(epilog=__doc__,
@@ -182,6 +184,32 @@ parser.add_argument('input', type=argparse.FileType('rt'))
 parser.add_argument('--part-two', action='store_true')
 args = parser.parse_args()
 
+# as per puzzle definition, an adapter takes 1, 2 or 3 jolts less
+MAX_DIFFERENCE = 3
+
+
+def count_arrangements(adapters: List[int]) -> int:
+    """
+    ways(joltage) = sum of ways(joltage - d) for d in 1..MAX_DIFFERENCE, with
+    adapters sorted and starting at the outlet. Only the last joltages within
+    MAX_DIFFERENCE are kept, so memory doesn't grow with the results.
+    """
+    recent: Deque[Tuple[int, int]] = deque([(adapters[0], 1)])
+
+    for joltage in adapters[1:]:
+        while joltage - recent[0][0] > MAX_DIFFERENCE:
+            recent.popleft()
+            if not recent:
+                # gap too large, there is no arrangement at all
+                return 0
+
+        # adapters of equal joltage can't be chained
+        ways = sum(count for previous, count in recent if previous < joltage)
+        recent.append((joltage, ways))
+
+    return recent[-1][1]
+
+
 adapters = sorted(int(line.strip()) for line in args.input)
 
 # add outlet
@@ -190,37 +218,15 @@ adapters.insert(0, 0)
 # add built-in adapter
 adapters.append(adapters[-1] + 3)
 
-differences = list(map(lambda pair: pair[1] - pair[0],
-                       pairwise(adapters)))
-
 if not args.part_two:
+    differences = list(map(lambda pair: pair[1] - pair[0],
+                           pairwise(adapters)))
+
     print(differences.count(1) * differences.count(3))
 else:
-    # build groups of consequetives ones
-    def acc_sequence_of_ones(state, v: int):
-        if v == 3 and state[-1]:
-            # have seen ones before, close group
-            state.append([])
-        elif v == 1:
-            # add to last group
-            state[-1].append(1)
-        else:
-            # return copy of current state
-            return list(state)
-
-    groups_of_ones = list(accumulate(differences[:-1],
-                                     acc_sequence_of_ones,
-                                     initial=[[]]))[-1]
-
-    arrangements = 1
-    for group in groups_of_ones:
-        # looking at this locally, any permutation here will cause permutations
-        # in all other places too, so we multiply
-        arrangements *= {
-            1: 1,
-            2: 2,
-            3: 4,
-            4: 7
-        }[len(group)]
-
-    print(arrangements)
+    # results for large adapter bags exceed the default limit of digits
+    # Python converts to a string
+    if hasattr(sys, 'set_int_max_str_digits'):
+        sys.set_int_max_str_digits(0)
+
+    print(count_arrangements(adapters))
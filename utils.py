@@ -1,9 +1,33 @@
 from itertools import tee
-from typing import Iterable, List
+from typing import Iterable, Iterator, List
 
 def flatten(iterable: Iterable) -> List:
     return [e for sub_iterable in iterable for e in sub_iterable]
 
+
+def split_records(lines: Iterable[str]) -> Iterator[List[str]]:
+    "Yield blank-line separated records as lists of stripped lines"
+    record = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            record.append(line)
+        elif record:
+            yield record
+            record = []
+
+    # last record may not be followed by a blank line
+    if record:
+        yield record
+
+def set_bits(mask: int) -> Iterator[int]:
+    "Yield indices of set bits, lowest first"
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
 # from more-itertools:
 # https://more-itertools.readthedocs.io/en/stable/_modules/more_itertools/recipes.html#pairwise
 